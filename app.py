@@ -1,24 +1,38 @@
 import streamlit as st
 
-from mcp_client import run_tool
+from mcp_client import list_tools, run_tool, stream_tool
 from openai import OpenAI
 import json
 from dotenv import load_dotenv
 import os
 from datetime import datetime
 import uuid
+import re
+from collections import deque, OrderedDict
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+import hashlib
+from PIL import Image
+import numpy as np
 from supabase import create_client, Client
 
-# Load .env file
-load_dotenv()
+# Must be the first Streamlit command; cached getters below may emit a spinner
+st.set_page_config(page_title="MCP Assistant Playground", layout="centered")
 
+# Clients are built once per process; Streamlit reruns only hit the cache.
+@st.cache_resource(show_spinner=False)
+def get_supabase() -> Client:
+    load_dotenv()
+    return create_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_KEY"))
 
-# Supabase config
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+@st.cache_resource(show_spinner=False)
+def get_openai() -> OpenAI:
+    load_dotenv()
+    return OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
 # Init Supabase client
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+supabase: Client = get_supabase()
 
 
 
@@ -31,10 +45,41 @@ def safe_json(obj):
 def is_data_audio_url(text):
     return isinstance(text, str) and text.startswith("data:audio/")
 
+def is_audio_url(text):
+    return is_data_audio_url(text) or (isinstance(text, str) and text.startswith(("http://", "https://")))
+
+@st.cache_resource
+def io_pool():
+    # Shared across reruns so we don't leak a new executor on every interaction
+    return ThreadPoolExecutor(max_workers=4)
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def compress_camera_image(raw_bytes, max_size=(1024, 1024), quality=80):
+    # st.camera_input returns a PNG; re-encode so the upload really is a (small) JPEG
+    img = Image.open(BytesIO(raw_bytes)).convert("RGB")
+    img.thumbnail(max_size)
+    buffer = BytesIO()
+    img.save(buffer, "JPEG", quality=quality, optimize=True)
+    return buffer.getvalue()
+
+def describe_image(image_url):
+    result = run_tool("describe_image_from_camera", {"image_url": image_url})
+
+    # ✨ Try to extract clean description
+    if hasattr(result, "content") and isinstance(result.content, list):
+        text_item = result.content[0]
+        if hasattr(text_item, "text"):
+            return text_item.text
+    return str(result)
+
+def upload_camera_image(image_bytes):
+    filename = f"camera_uploads/{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex}.jpg"
+    supabase.storage.from_("damage-images").upload(filename, image_bytes, {"content-type": "image/jpeg"})
+    return supabase.storage.from_("damage-images").get_public_url(filename)
+
 # -- OpenAI config
-openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+openai_client = get_openai()
 
-st.set_page_config(page_title="MCP Assistant Playground", layout="centered")
 st.markdown("""
     <style>
     .stTextInput input {
@@ -58,8 +103,24 @@ st.caption("Use natural language to call MCP tools via OpenAI GPT-4o.")
 
 
 # -- Session history
+# Only the last MAX_TURNS messages are kept (and re-rendered on each rerun);
+# older ones are moved to archived_messages.
+MAX_TURNS = 40
+MAX_ARCHIVED = 500
+
 if "messages" not in st.session_state:
     st.session_state.messages = []
+if "archived_messages" not in st.session_state:
+    st.session_state.archived_messages = deque(maxlen=MAX_ARCHIVED)
+
+def append_message(role: str, content: str):
+    # content is stored as final markdown (tool JSON already serialized via
+    # safe_json), so the history loop never re-serializes on a rerun.
+    messages = st.session_state.messages
+    messages.append({"role": role, "content": content})
+    if len(messages) > MAX_TURNS:
+        st.session_state.archived_messages.extend(messages[:-MAX_TURNS])
+        st.session_state.messages = messages[-MAX_TURNS:]
 
 # -- Display conversation
 with st.container():
@@ -72,62 +133,426 @@ with st.container():
 user_input = st.chat_input("Type your question or command here...")
 
 # -- GPT Router
-def select_tool_using_gpt(prompt: str):
-    system_prompt = """
-You are a tool routing assistant. You receive a natural language user request and determine which MCP tool to use.
-
-Available tools and their signatures:
-- chat_gpt4o(prompt: str)
-- gen_image_dalle3(prompt: str)
-- get_all_members(role?: str, search?: str)
-- get_member_by_id(member_id: str)
-- create_member(name: str, email: str, role?: str, status?: str)
-- update_member(member_id: str, name?: str, email?: str, role?: str, status?: str)
-- delete_member(member_id: str)
-- text_to_speech_gpt4o(text: str, voice: str = "nova", tone: str = "cheerful")
-- capture_image_from_camera()
-- describe_image_from_camera(image_url: str)
-
-Notes:
-- If the user says something like "describe this image", "what is in the image", "analyze the photo", and there is already an image captured, use `describe_image_from_camera`.
-- If the user says "open the camera", "take a picture", "capture photo", or anything related to opening the webcam, use `capture_image_from_camera`.
-- For everything else, fallback to `chat_gpt4o`.
-
-Respond ONLY in compact JSON like:
-{ "tool": "tool_name", "args": { "arg1": "value", ... } }
+# One gpt-4o-mini call with the MCP tools exposed as native OpenAI functions:
+# it either returns a tool call or answers the user directly. The system
+# prompt and tool list are built once and never vary, so every call shares
+# the same prefix for OpenAI prompt caching, which needs >1024 tokens. The
+# tool reference keeps the prefix past that threshold on its own, so it must
+# stay stable (no timestamps, no per-user data).
+_ROUTER_SYSTEM_PROMPT = """
+You are the assistant of the MCP Assistant Playground. You can answer the user directly or call one of the provided tools.
+
+Rules:
+- Call at most one tool per message.
+- If the user asks to open the camera, take a picture, capture a photo, or anything related to the webcam, call `capture_image_from_camera`.
+- If the user asks to describe, analyze, or explain what is in "this image", "the photo" or "the picture", call `describe_image_from_camera` with no arguments. The app attaches the most recently captured image itself.
+- If the user asks to draw, paint, render, generate or create a picture, illustration, logo, poster or artwork, call `gen_image_dalle3`. Pass only the subject and style as the prompt and drop filler such as "please generate an image of".
+- If the user asks to say, speak, read aloud, pronounce or narrate something, call `text_to_speech_gpt4o` with the exact text to speak. Only set voice or tone when the user asks for one.
+- Member requests ("list admins", "find members named John", "get member 42", "add Jane as an admin", "deactivate member 7", "remove member 13") map to the member tools. For `update_member`, only pass the fields the user asked to change.
+- Never invent IDs, emails or URLs. If a required argument is missing, ask the user for it instead of calling a tool.
+- For everything else (questions, explanations, writing, translation, coding help, summaries, small talk), do not call a tool. Answer directly in Markdown.
+
+Tool reference:
+
+gen_image_dalle3
+  Generates a new image with DALL·E 3 from a text description and returns a
+  public image URL. Use it when the user asks to draw, paint, render, generate
+  or create a picture, illustration, logo, poster or artwork. It cannot edit or
+  describe an existing image.
+  Args:
+    prompt (required): A description of the image. Keep the subject, style,
+      colors and composition the user asked for; drop filler such as "please
+      generate an image of".
+  Example: "Draw a cat astronaut floating above the moon, watercolor style"
+    -> gen_image_dalle3(prompt="a cat astronaut floating above the moon, watercolor style")
+
+get_all_members
+  Lists members stored in Supabase with optional filtering, searching, sorting
+  and pagination. Use it for "show all members", "list admins", "find members
+  named John", "who joined most recently" and similar requests.
+  Args:
+    role (optional): Filter by role, e.g. "admin" or "user".
+    search (optional): Case-insensitive match on name or email.
+    limit (optional, default 10): Number of rows to return.
+    offset (optional, default 0): Number of rows to skip.
+    sort (optional, default "created_at"): Column to sort by.
+    order (optional, default "desc"): "asc" or "desc".
+  Example: "Show me the first 5 admins"
+    -> get_all_members(role="admin", limit=5)
+
+get_member_by_id
+  Fetches a single member by ID. Use it only when the user gives an ID; for a
+  name or email, use get_all_members with search instead.
+  Args:
+    member_id (required): The member's ID, exactly as the user wrote it.
+  Example: "Get member 42" -> get_member_by_id(member_id="42")
+
+create_member
+  Creates a new member record. Name and email must both come from the user.
+  Args:
+    name (required): Full name.
+    email (required): Email address.
+    role (optional, default "user"): Role of the member.
+    status (optional, default "active"): Status of the member.
+  Example: "Add Jane Doe, jane@example.com, as an admin"
+    -> create_member(name="Jane Doe", email="jane@example.com", role="admin")
+
+update_member
+  Updates fields of an existing member. Only include the fields the user asked
+  to change; never send fields that were not mentioned.
+  Args:
+    member_id (required): ID of the member to update.
+    name, email, role, status (optional): New values.
+  Example: "Deactivate member 7"
+    -> update_member(member_id="7", status="inactive")
+
+delete_member
+  Permanently deletes a member by ID. Only call it when the user clearly asks
+  to delete or remove a specific member.
+  Args:
+    member_id (required): ID of the member to delete.
+  Example: "Remove member 13" -> delete_member(member_id="13")
+
+text_to_speech_gpt4o
+  Converts text to spoken audio with GPT-4o mini TTS and returns an audio URL.
+  Use it when the user asks to say, speak, read aloud, pronounce or narrate
+  something.
+  Args:
+    text (required): The exact text to speak, without the instruction itself.
+    voice (optional, default "nova"): One of "nova", "shimmer", "onyx", "echo",
+      "fable", "alloy".
+    tone (optional, default "cheerful"): Speaking style, e.g. "serious", "calm",
+      "excited".
+  Example: "Say good morning everyone in a calm voice"
+    -> text_to_speech_gpt4o(text="good morning everyone", tone="calm")
+
+capture_image_from_camera
+  Opens the webcam in the UI so the user can take a photo. Takes no arguments.
+  Example: "Open the camera" -> capture_image_from_camera()
+
+describe_image_from_camera
+  Describes the most recently captured camera image with a vision model. Takes
+  no arguments; the app attaches the image. If no image has been captured yet,
+  the app asks the user to take one.
+  Example: "What's in this picture?" -> describe_image_from_camera()
 """.strip()
 
-    try:
-        response = openai_client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": prompt}
-            ]
-        )
+# Tools answered by the model itself instead of being exposed as functions
+_DIRECT_REPLY_TOOLS = {"chat_gpt4o"}
+# Arguments filled in by the app or the client, hidden from the model
+_HIDDEN_TOOL_ARGS = {
+    "chat_gpt4o": {"stream_id"},
+    "describe_image_from_camera": {"image_url"},
+}
+
+
+@st.cache_resource
+def get_openai_tools():
+    tools = []
+    for t in list_tools():
+        if t.name in _DIRECT_REPLY_TOOLS:
+            continue
+        hidden = _HIDDEN_TOOL_ARGS.get(t.name, set())
+        schema = dict(t.inputSchema)
+        schema["properties"] = {k: v for k, v in schema.get("properties", {}).items() if k not in hidden}
+        schema["required"] = [k for k in schema.get("required", []) if k not in hidden]
+        tools.append({
+            "type": "function",
+            "function": {"name": t.name, "description": (t.description or "").strip(), "parameters": schema},
+        })
+    return tools
+
+
+# Fast-path routes for unambiguous intents: (pattern, tool, args).
+# args=None means "use the pattern's named groups as args".
+# Every pattern is a whole-message imperative ("open the camera", "describe
+# this photo"); anything longer or phrased as a question goes to the model.
+_PLEASE = r"^\s*(please\s+)?"
+_END = r"(\s+please)?\s*[?.!]?\s*$"
+_ROUTES = [
+    (re.compile(_PLEASE + r"(open|start|enable|turn\s+on)\s+(the\s+|my\s+)?(camera|webcam)" + _END, re.I), "capture_image_from_camera", {}),
+    (re.compile(_PLEASE + r"(take|capture|snap)\s+(a\s+)?(picture|photo|selfie)" + _END, re.I), "capture_image_from_camera", {}),
+    # Before describe, so "draw an image of ... this picture" still generates
+    (re.compile(_PLEASE + r"(generate|draw|create|paint)\s+(me\s+)?(an?\s+)?(image|picture|illustration)\s+of\s+(?P<prompt>.+)", re.I), "gen_image_dalle3", None),
+    (re.compile(_PLEASE + r"(describe|analy[sz]e|explain)\s+(this|that|the|my)\s+(image|photo|picture)" + _END, re.I), "describe_image_from_camera", {}),
+    (re.compile(r"^\s*what(\s+is|'s)\s+in\s+(this|that|the|my)\s+(image|photo|picture)" + _END, re.I), "describe_image_from_camera", {}),
+    # Only explicit "say: ..." or quoted text; "say what you think about ..." is a question
+    (re.compile(r"^\s*(say|speak|read\s+aloud)\s*:\s*(?P<text>.+)", re.I), "text_to_speech_gpt4o", None),
+    (re.compile(r"^\s*(say|speak|read\s+aloud)\s+[\"“](?P<text>[^\"”]+)[\"”]\s*$", re.I), "text_to_speech_gpt4o", None),
+]
+_QUESTION_OPENERS = re.compile(r"^\s*(how|why|when|where|which|can\s+you\s+explain|could\s+you\s+explain)\b", re.I)
+
+
+def _match_route(prompt: str):
+    if _QUESTION_OPENERS.match(prompt):
+        return None
+    for pattern, tool, args in _ROUTES:
+        m = pattern.search(prompt)
+        if m:
+            return {"tool": tool, "args": dict(args) if args is not None else m.groupdict()}
+    return None
 
-        raw = response.choices[0].message.content.strip()
 
-        # ✅ Strip markdown formatting if present
-        if raw.startswith("```json") and raw.endswith("```"):
-            raw = raw.removeprefix("```json").removesuffix("```").strip()
+def select_tool_using_gpt(prompt: str):
+    routing = _match_route(prompt)
+    if routing:
+        print("⚡ [ToolSelector] Fast-path route:", routing["tool"])
+        return routing
 
-        # ✅ Parse JSON safely
-        return json.loads(raw)
+    cached = _exact_route_get(prompt)
+    if cached:
+        return cached
 
+    try:
+        routing = _route_semantic(prompt)
     except Exception as e:
-        print("❌ [ToolSelector] Invalid JSON or OpenAI error:", e)
-        print("🔎 Raw GPT Output:", raw if 'raw' in locals() else '[no response]')
-        return {
-            "tool": "chat_gpt4o",
-            "args": {
-                "prompt": f"ERROR: Invalid JSON returned: {raw if 'raw' in locals() else str(e)}"
-            }
-        }
-        
+        # Let chat_gpt4o answer the original question rather than failing the turn
+        print("❌ [ToolSelector] Routing failed, falling back to chat_gpt4o:", e)
+        return {"tool": "chat_gpt4o", "args": {"prompt": prompt}}
+
+    # Direct answers are produced by this call itself; caching them would
+    # only replay a stale reply, so only tool routes are stored
+    if "reply_stream" not in routing:
+        _exact_route_put(prompt, routing)
+    return routing
+
+
+_PROMPT_CACHE_MIN_TOKENS = 1024
+
+
+def _log_usage(usage):
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", 0) if details else 0
+    print(f"🧮 [ToolSelector] prompt_tokens={usage.prompt_tokens} cached_tokens={cached}")
+    if usage.prompt_tokens < _PROMPT_CACHE_MIN_TOKENS:
+        print(f"⚠️ [ToolSelector] Prompt is under {_PROMPT_CACHE_MIN_TOKENS} tokens and will never be cached; pad _ROUTER_SYSTEM_PROMPT")
+
+
+def _call_gpt_router(prompt: str):
+    # Streamed, so a direct answer renders token by token; the first delta
+    # says whether this is a tool call or an answer
+    stream = openai_client.chat.completions.create(
+        model="gpt-4o-mini",
+        temperature=0,
+        tools=get_openai_tools(),
+        # One tool per turn; the app dispatches a single route
+        parallel_tool_calls=False,
+        messages=[
+            {"role": "system", "content": _ROUTER_SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ],
+        stream=True,
+        stream_options={"include_usage": True},
+    )
+    chunks = iter(stream)
+
+    for chunk in chunks:
+        if chunk.usage:
+            _log_usage(chunk.usage)
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta
+        if delta.tool_calls:
+            return _collect_tool_call(delta, chunks)
+        if delta.content:
+            return {"tool": "chat_gpt4o", "args": {"prompt": prompt}, "reply_stream": _reply_stream(delta.content, chunks)}
+
+    return {"tool": "chat_gpt4o", "args": {"prompt": prompt}, "reply_stream": iter(())}
+
+
+def _add_tool_call_delta(delta, name, arguments):
+    # Only the first tool call is used (the prompt asks for at most one)
+    for tc in delta.tool_calls or []:
+        if tc.index == 0 and tc.function:
+            name.append(tc.function.name or "")
+            arguments.append(tc.function.arguments or "")
+
+
+def _collect_tool_call(first_delta, chunks):
+    name, arguments = [], []
+
+    _add_tool_call_delta(first_delta, name, arguments)
+    for chunk in chunks:
+        if chunk.usage:
+            _log_usage(chunk.usage)
+        if chunk.choices:
+            _add_tool_call_delta(chunk.choices[0].delta, name, arguments)
+
+    raw = "".join(arguments) or "{}"
+    try:
+        return {"tool": "".join(name), "args": json.loads(raw)}
+    except json.JSONDecodeError as e:
+        print("🔎 Raw tool arguments:", raw)
+        raise ValueError(raw) from e
+
+
+def _reply_stream(first, chunks):
+    name, arguments = [], []
+    yield first
+    for chunk in chunks:
+        if chunk.usage:
+            _log_usage(chunk.usage)
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta
+        if delta.content:
+            yield delta.content
+        _add_tool_call_delta(delta, name, arguments)
+
+    # The model answered first and then called a tool; the answer has already
+    # been rendered as the turn, so the call is only logged, not dispatched
+    if name:
+        print("⚠️ [ToolSelector] Tool call after direct answer ignored:", "".join(name), "".join(arguments))
+
+
+# -- Route cache
+# Two tiers in front of the GPT router: exact prompt match, then embedding
+# similarity. Stores live in st.cache_resource rather than module globals
+# because Streamlit re-executes this script on every rerun. Errors raise out
+# of the router before anything is stored, so they are never cached.
+_ROUTE_CACHE_PATH = os.path.join(".cache", "routes.jsonl")
+_EXACT_MAX_ENTRIES = 512
+_SEMANTIC_THRESHOLD = 0.93
+# Only argument-free routes (camera, describe) are stored, and those are short
+# commands, so longer prompts skip the embedding call entirely.
+_SEMANTIC_MAX_WORDS = 12
+_SEMANTIC_MAX_ENTRIES = 256
+
+
+@st.cache_resource(show_spinner=False)
+def _semantic_routes():
+    # Shared across sessions like the exact tier; "lock" keeps rows, routes
+    # and matrix in step and serializes writes to the jsonl file
+    store = {
+        "routes": deque(maxlen=_SEMANTIC_MAX_ENTRIES),
+        "rows": deque(maxlen=_SEMANTIC_MAX_ENTRIES),
+        "matrix": None,
+        "lock": threading.Lock(),
+    }
+    if os.path.exists(_ROUTE_CACHE_PATH):
+        with open(_ROUTE_CACHE_PATH, encoding="utf-8") as f:
+            lines = f.readlines()
+        for line in lines[-_SEMANTIC_MAX_ENTRIES:]:
+            try:
+                row = json.loads(line)
+                store["rows"].append(np.array(row["embedding"]))
+                store["routes"].append(row["routing"])
+            except (ValueError, KeyError):
+                continue
+        if len(lines) > _SEMANTIC_MAX_ENTRIES:
+            # Trim the file back to what we keep in memory
+            with open(_ROUTE_CACHE_PATH, "w", encoding="utf-8") as f:
+                f.writelines(lines[-_SEMANTIC_MAX_ENTRIES:])
+        if store["rows"]:
+            store["matrix"] = np.stack(store["rows"])
+    return store
+
+
+def _embed(prompt: str):
+    response = openai_client.embeddings.create(model="text-embedding-3-small", input=prompt)
+    vec = np.array(response.data[0].embedding)
+    return vec / np.linalg.norm(vec)
+
+
+def _route_semantic(prompt: str):
+    store = _semantic_routes()
+    vec = None
+
+    if store["matrix"] is not None and len(prompt.split()) <= _SEMANTIC_MAX_WORDS:
+        vec = _embed(prompt)
+        with store["lock"]:
+            sims = store["matrix"] @ vec
+            best = int(np.argmax(sims))
+            hit = store["routes"][best] if sims[best] > _SEMANTIC_THRESHOLD else None
+        if hit is not None:
+            print(f"🧠 [ToolSelector] Semantic cache hit ({sims[best]:.3f}):", hit["tool"])
+            return hit
+
+    routing = _call_gpt_router(prompt)
+
+    # Only argument-free routes are reused for near-matches; "get member 42"
+    # and "get member 43" embed almost identically but need different args.
+    if not routing.get("args") and len(prompt.split()) <= _SEMANTIC_MAX_WORDS:
+        if vec is None:
+            vec = _embed(prompt)
+        with store["lock"]:
+            store["rows"].append(vec)
+            store["routes"].append(routing)
+            # Rebuilt on insert (rare), not on every lookup
+            store["matrix"] = np.stack(store["rows"])
+            os.makedirs(os.path.dirname(_ROUTE_CACHE_PATH), exist_ok=True)
+            with open(_ROUTE_CACHE_PATH, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"prompt": prompt, "embedding": vec.tolist(), "routing": routing}) + "\n")
+
+    return routing
+
+
+@st.cache_resource(show_spinner=False)
+def _exact_routes():
+    return OrderedDict(), threading.Lock()
+
+
+def _exact_route_get(prompt: str):
+    routes, lock = _exact_routes()
+    with lock:
+        raw = routes.get(prompt)
+        if raw is not None:
+            routes.move_to_end(prompt)
+    # Stored as JSON so callers never mutate the cached args
+    return json.loads(raw) if raw is not None else None
+
+
+def _exact_route_put(prompt: str, routing):
+    routes, lock = _exact_routes()
+    with lock:
+        routes[prompt] = json.dumps(routing)
+        routes.move_to_end(prompt)
+        while len(routes) > _EXACT_MAX_ENTRIES:
+            routes.popitem(last=False)
+
+
 # -- Process input
 
-if st.session_state.get("selected_tool") in ["capture_image_from_camera", "describe_image_from_camera", "text_to_speech_gpt4o", "gen_image_dalle3", "chat_gpt4o"]:
+# Camera uploads run on io_pool() and never block a rerun. The future lives in
+# session state; poll_camera_upload() picks up the URL once it is done, and
+# resolve_camera_upload() waits only when a tool actually needs the image.
+def poll_camera_upload():
+    future = st.session_state.get("upload_future")
+    if future is None or not future.done():
+        return
+    # Clear first so a failed upload is retried on the next rerun
+    del st.session_state["upload_future"]
+    upload_hash = st.session_state.pop("upload_future_hash")
+    st.session_state.last_uploaded_image_url = future.result()
+    st.session_state.last_uploaded_image_hash = upload_hash
+
+def resolve_camera_upload():
+    future = st.session_state.get("upload_future")
+    if future is not None:
+        future.result()
+    poll_camera_upload()
+
+def camera_upload_status():
+    was_pending = st.session_state.get("upload_future") is not None
+    poll_camera_upload()
+    if was_pending and st.session_state.get("upload_future") is None:
+        # run_every is only registered by a full run; rerun the app so the
+        # fragment is re-registered without it and the polling stops
+        st.rerun(scope="app")
+    if st.session_state.get("upload_future") is not None:
+        st.markdown("⏳ Uploading to Supabase...")
+    elif st.session_state.get("last_uploaded_image_url"):
+        st.markdown(f"✅ Uploaded to Supabase: `{st.session_state.last_uploaded_image_url}`")
+
+camera_ui_shown = False
+
+def camera_ui():
+    """Render the camera widgets and start the upload; no-op after the first call per run."""
+    global camera_ui_shown
+    if camera_ui_shown:
+        return
+    camera_ui_shown = True
+
     st.markdown("📸 **Camera Mode Activated!**")
 
     if "camera_enabled" not in st.session_state:
@@ -143,34 +568,56 @@ if st.session_state.get("selected_tool") in ["capture_image_from_camera", "descr
             st.session_state.captured_image = picture
 
     if st.session_state.captured_image:
-        image_bytes = st.session_state.captured_image.getvalue()
-
-        # Upload to Supabase
-        filename = f"camera_uploads/{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex}.jpg"
-        supabase.storage.from_("damage-images").upload(filename, image_bytes, {"content-type": "image/jpeg"})
-        image_url = supabase.storage.from_("damage-images").get_public_url(filename)
-        st.session_state.last_uploaded_image_url = image_url
-
-        st.markdown(f"✅ Uploaded to Supabase: `{image_url}`")
+        image_bytes = compress_camera_image(st.session_state.captured_image.getvalue())
+        upload_hash = hashlib.sha1(image_bytes).hexdigest()
+
+        # Same picture as the last (or in-flight) upload: nothing to do
+        poll_camera_upload()
+        if upload_hash not in (st.session_state.get("last_uploaded_image_hash"), st.session_state.get("upload_future_hash")):
+            st.session_state.upload_future = io_pool().submit(upload_camera_image, image_bytes)
+            st.session_state.upload_future_hash = upload_hash
+
+        # Poll once a second while the upload is in flight so the URL shows up without user input
+        pending = st.session_state.get("upload_future") is not None
+        st.fragment(camera_upload_status, run_every=1 if pending else None)()
     else:
         st.info("📷 Please take a picture to proceed.")
 
+if st.session_state.get("selected_tool") in ["capture_image_from_camera", "describe_image_from_camera", "text_to_speech_gpt4o", "gen_image_dalle3", "chat_gpt4o"]:
+    camera_ui()
+
 if user_input:
-    st.session_state.messages.append({"role": "user", "content": user_input})
+    append_message("user", user_input)
+
+    # Speculatively describe the current image while the router runs; the
+    # result is cached per URL, so it isn't wasted if another tool is picked.
+    descriptions = st.session_state.setdefault("image_descriptions", {})
+    describe_future = None
+    speculative_url = st.session_state.get("last_uploaded_image_url")
+    if st.session_state.get("upload_future") is None and speculative_url and speculative_url not in descriptions:
+        describe_future = io_pool().submit(describe_image, speculative_url)
+        describe_future.add_done_callback(
+            lambda f: descriptions.setdefault(speculative_url, f.result()) if not f.exception() else None
+        )
 
     with st.chat_message("assistant"):
         with st.spinner("🔍 GPT is selecting the best MCP tool..."):
             routing = select_tool_using_gpt(user_input)
             tool = routing.get("tool")
             args = routing.get("args", {})
+            reply_stream = routing.get("reply_stream")
 
-            st.markdown(f"🛠️ **Running `{tool}` with args:**\n```json\n{safe_json(args)}\n```")
+            if reply_stream is None:
+                st.markdown(f"🛠️ **Running `{tool}` with args:**\n```json\n{safe_json(args)}\n```")
 
-            try:
-                tool_result = run_tool(tool, args)
-                result = tool_result.output if hasattr(tool_result, "output") else tool_result
-            except Exception as e:
-                result = {"error": str(e)}
+            if tool in ("chat_gpt4o", "describe_image_from_camera"):
+                result = None  # handled in the tool branch below
+            else:
+                try:
+                    tool_result = run_tool(tool, args)
+                    result = tool_result.output if hasattr(tool_result, "output") else tool_result
+                except Exception as e:
+                    result = {"error": str(e)}
 
             # Render tool response
             if tool == "gen_image_dalle3":
@@ -198,12 +645,12 @@ if user_input:
                         if hasattr(text_item, "text") and isinstance(text_item.text, str):
                             audio_url = text_item.text
 
-                            if is_data_audio_url(audio_url):
+                            if is_audio_url(audio_url):
                                 st.markdown("🎤 **Speech generated:**")
                                 st.audio(audio_url, format="audio/mp3")
                                 content = f"🔊 *Speech synthesized for:* `{args.get('prompt', '')}`"
                             else:
-                                content = f"❌ Invalid audio data URL:\n\n```json\n{safe_json(audio_url)}\n```"
+                                content = f"❌ Invalid audio URL:\n\n```json\n{safe_json(audio_url)}\n```"
                         else:
                             content = f"⚠️ Unexpected audio content:\n\n```json\n{safe_json(result)}\n```"
                     else:
@@ -212,57 +659,52 @@ if user_input:
                     content = f"❌ Error handling audio response:\n\n{str(e)}"
             elif tool == "capture_image_from_camera":
                 st.session_state.selected_tool = tool
-                st.markdown("📸 **Camera Mode Activated!**")
-                
-                if "camera_enabled" not in st.session_state:
-                    st.session_state.camera_enabled = False
-                if "captured_image" not in st.session_state:
-                    st.session_state.captured_image = None
-
-                st.session_state.camera_enabled = st.checkbox("Enable camera", value=st.session_state.camera_enabled, key="enable_camera_capture")
-
-                if st.session_state.camera_enabled:
-                    picture = st.camera_input("Take a picture")
-                    if picture:
-                        st.session_state.captured_image = picture
+                camera_ui()
+                resolve_camera_upload()
+                image_url = st.session_state.get("last_uploaded_image_url")
 
-                if st.session_state.captured_image:
+                if st.session_state.captured_image and image_url:
                     st.markdown("✅ Image captured!")
-
-                    image_bytes = st.session_state.captured_image.getvalue()
-                    filename = f"camera_uploads/{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex}.jpg"
-                    supabase.storage.from_("damage-images").upload(filename, image_bytes, {"content-type": "image/jpeg"})
-                    image_url = supabase.storage.from_("damage-images").get_public_url(filename)
-                    st.session_state.last_uploaded_image_url = image_url
-                    st.markdown(f"📤 Uploaded to: `{image_url}`")
                     content = f"📸 [Image captured from camera] {image_url}"
                 else:
-                    st.info("📷 Please take a picture to proceed.")
                     content = "📷 Please take a picture to proceed."
             elif tool == "describe_image_from_camera":
                 st.session_state.selected_tool = tool
+                resolve_camera_upload()
                 image_url = st.session_state.get("last_uploaded_image_url")
                 
                 if image_url:
-                    result = run_tool("describe_image_from_camera", {"image_url": image_url})
-
-                    # ✨ Try to extract clean description
-                    if hasattr(result, "content") and isinstance(result.content, list):
-                        text_item = result.content[0]
-                        if hasattr(text_item, "text"):
-                            clean_description = text_item.text
-                        else:
-                            clean_description = str(result)
+                    if image_url in descriptions:
+                        clean_description = descriptions[image_url]
+                    elif describe_future is not None and image_url == speculative_url:
+                        try:
+                            clean_description = describe_future.result()
+                        except Exception as e:
+                            print("⚠️ Speculative describe failed, retrying:", e)
+                            clean_description = describe_image(image_url)
+                            descriptions[image_url] = clean_description
                     else:
-                        clean_description = str(result)
+                        clean_description = describe_image(image_url)
+                        descriptions[image_url] = clean_description
                     st.markdown(f"🔍 **Image description:**\n\n> {clean_description}")
                     content = ""
                 else:
                     st.info("📸 Please capture an image first.")
                     content = "📸 Please capture an image first."
+            elif tool == "chat_gpt4o":
+                st.session_state.selected_tool = tool
+                try:
+                    if reply_stream is not None:
+                        content = st.write_stream(reply_stream)
+                    else:
+                        content = st.write_stream(stream_tool(tool, args))
+                except Exception as e:
+                    content = f"❌ Error streaming response: {str(e)}"
+                    st.markdown(content)
             else:
                 content = f"**✅ Tool:** `{tool}`\n\n```json\n{safe_json(result)}\n```"
 
             if content.strip():
-                st.markdown(content)
-                st.session_state.messages.append({"role": "assistant", "content": content})
+                if tool != "chat_gpt4o":  # already rendered by st.write_stream
+                    st.markdown(content)
+                append_message("assistant", content)
\ No newline at end of file
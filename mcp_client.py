@@ -1,5 +1,11 @@
 import asyncio
+import atexit
+import queue
+import threading
+import uuid
+from datetime import timedelta
 
+import anyio
 from langchain_mcp_adapters.tools import load_mcp_tools
 from langchain_openai import ChatOpenAI
 from langgraph.prebuilt import create_react_agent
@@ -11,12 +17,171 @@ server_params = StdioServerParameters(
     args=["mcp_server.py"],
 )
 
+# No request may wait on a dead server forever. The session task notices a
+# closed server stdout within a second (pinging every PING_INTERVAL seconds
+# as a backstop), so the next call starts a fresh server.
+READ_TIMEOUT = timedelta(seconds=120)
+PING_INTERVAL = 10
+
+# One event loop + one MCP session for the whole process, so tool calls
+# don't pay for spawning mcp_server.py and the initialize handshake each time.
+_loop = asyncio.new_event_loop()
+_loop_thread = threading.Thread(target=_loop.run_forever, name="mcp-client", daemon=True)
+_loop_thread.start()
+
+def _submit(coro):
+    # Blocking on the loop from its own thread would deadlock; fail loudly instead
+    if threading.current_thread() is _loop_thread:
+        coro.close()
+        raise RuntimeError("mcp_client sync helpers can't be called from the MCP event loop; await the *_async variant")
+    return asyncio.run_coroutine_threadsafe(coro, _loop)
+
+_session = None
+_session_task = None
+_session_lock = asyncio.Lock()
+_stop = None
+
+# stream_id -> queue of text chunks pushed by the server as log notifications
+_streams = {}
+_streamed = set()  # stream_ids that already received a chunk (never retried)
+_STREAM_END = object()
+
+async def _on_log(params):
+    logger = params.logger or ""
+    if logger.startswith("stream:"):
+        chunks = _streams.get(logger.removeprefix("stream:"))
+        if chunks is not None:
+            _streamed.add(logger.removeprefix("stream:"))
+            chunks.put(params.data)
+
+async def _serve_session(ready, stop):
+    # stdio_client/ClientSession must be entered and exited in the same task,
+    # so this task owns them. It ends on shutdown or when the server goes
+    # away, which marks the session as dead.
+    try:
+        async with stdio_client(server_params) as (read, write):
+            async with ClientSession(read, write, read_timeout_seconds=READ_TIMEOUT, logging_callback=_on_log) as session:
+                await session.initialize()
+                ready.set_result(session)
+                idle = 0
+                while not stop.is_set():
+                    try:
+                        await asyncio.wait_for(stop.wait(), timeout=1)
+                    except asyncio.TimeoutError:
+                        # stdio_client closes its end of `read` when the server's stdout hits EOF
+                        if read.statistics().open_send_streams == 0:
+                            raise anyio.EndOfStream()
+                        idle += 1
+                        if idle >= PING_INTERVAL:
+                            idle = 0
+                            await session.send_ping()
+    except Exception as e:
+        if not ready.done():
+            ready.set_exception(e)
+        else:
+            print("⚠️ [MCP client] Session closed:", repr(e))
+
+async def _get_session():
+    global _session, _session_task, _stop
+    async with _session_lock:
+        if _session is None or _session_task.done():
+            ready = _loop.create_future()
+            _stop = asyncio.Event()
+            _session_task = _loop.create_task(_serve_session(ready, _stop))
+            _session = await ready
+        return _session
+
+async def _drop_session(session):
+    global _session
+    async with _session_lock:
+        if _session is session:
+            _stop.set()
+            _session = None
+
+# Tools that are safe to send twice: reads, the camera trigger, and tools whose
+# server side is cached by content. Writes (create/update/delete_member) and
+# image generation are never replayed.
+_RETRY_SAFE_TOOLS = {
+    "get_all_members",
+    "get_member_by_id",
+    "capture_image_from_camera",
+    "describe_image_from_camera",
+    "text_to_speech_gpt4o",
+    "chat_gpt4o",
+}
+
+def _is_session_error(e):
+    # A read timeout (McpError 408) is not one: the session is still up, only
+    # that request was slow, so it is raised to the caller as is.
+    return isinstance(e, (anyio.ClosedResourceError, anyio.BrokenResourceError, anyio.EndOfStream))
+
+async def _call(fn, retry=True):
+    """Run fn(session); if the session is dead, start a new one and retry once."""
+    session = await _get_session()
+    try:
+        return await fn(session)
+    except Exception as e:
+        if not _is_session_error(e):
+            raise
+        await _drop_session(session)
+        if not (retry() if callable(retry) else retry):
+            raise
+        print("⚠️ [MCP client] Session lost, reconnecting:", repr(e))
+        return await fn(await _get_session())
+
+async def _close_session():
+    if _session_task is None or _session_task.done():
+        return
+    _stop.set()
+    try:
+        await _session_task
+    except BaseException:
+        pass
+
+@atexit.register
+def _shutdown():
+    try:
+        asyncio.run_coroutine_threadsafe(_close_session(), _loop).result(timeout=5)
+    except Exception:
+        pass
+    _loop.call_soon_threadsafe(_loop.stop)
+
 async def run_tool_async(tool_name, args):
-    async with stdio_client(server_params) as (read, write):
-        async with ClientSession(read, write) as session:
-            await session.initialize()
-            result = await session.call_tool(tool_name, arguments=args)
-            return result
+    # A call that already streamed chunks is not retried, or the text would repeat
+    retry = lambda: tool_name in _RETRY_SAFE_TOOLS and args.get("stream_id") not in _streamed
+    async def call(session):
+        return await session.call_tool(tool_name, arguments=args)
+    return await _call(call, retry=retry)
+
+async def list_tools_async():
+    async def call(session):
+        return (await session.list_tools()).tools
+    return await _call(call)
+
+def list_tools():
+    return _submit(list_tools_async()).result()
 
 def run_tool(tool_name, args):
-    return asyncio.run(run_tool_async(tool_name, args))
\ No newline at end of file
+    return _submit(run_tool_async(tool_name, args)).result()
+
+def stream_tool(tool_name, args):
+    """Call a streaming tool (e.g. chat_gpt4o) and yield text chunks as they arrive."""
+    stream_id = uuid.uuid4().hex
+    chunks = queue.Queue()
+    _streams[stream_id] = chunks
+    future = _submit(run_tool_async(tool_name, {**args, "stream_id": stream_id}))
+    future.add_done_callback(lambda _: chunks.put(_STREAM_END))
+
+    try:
+        streamed = False
+        while (chunk := chunks.get()) is not _STREAM_END:
+            streamed = True
+            yield chunk
+
+        result = future.result()
+        # Nothing streamed (e.g. an error string): fall back to the final result
+        if not streamed and result.content and hasattr(result.content[0], "text"):
+            yield result.content[0].text
+    finally:
+        _streams.pop(stream_id, None)
+        _streamed.discard(stream_id)
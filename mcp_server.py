@@ -1,37 +1,75 @@
-from mcp.server.fastmcp import FastMCP
+from mcp.server.fastmcp import FastMCP, Context
 from supabase import create_client, Client
 import os
-from openai import OpenAI
-import asyncio
-import base64
-from io import BytesIO
+import sys
+import logging
+import functools
+import hashlib
+import sqlite3
+import threading
+from openai import OpenAI, AsyncOpenAI
 from pydub import AudioSegment
 from dotenv import load_dotenv
-
-# Load .env file
-load_dotenv()
-
-# Supabase config
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY")
-
-# Init Supabase client
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+from cachetools import TTLCache
+import anyio
+
+# stdout carries the MCP stdio protocol, so logs must go to stderr
+log = logging.getLogger("mcp_server")
+_log_level = os.getenv("MCP_LOG", "WARNING").upper()
+log.setLevel(logging.getLevelNamesMapping().get(_log_level, logging.WARNING))
+_log_handler = logging.StreamHandler(sys.stderr)
+_log_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+log.addHandler(_log_handler)
+log.propagate = False
+if _log_level not in logging.getLevelNamesMapping():
+    # A typo in MCP_LOG shouldn't stop the server from starting
+    log.warning("Unknown MCP_LOG level %r, using WARNING", _log_level)
+
+# Clients are created on first use, so importing the server stays cheap
+@functools.cache
+def get_supabase() -> Client:
+    load_dotenv()
+    return create_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_KEY"))
+
+@functools.cache
+def get_openai() -> OpenAI:
+    load_dotenv()
+    return OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+@functools.cache
+def get_async_openai() -> AsyncOpenAI:
+    load_dotenv()
+    return AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
 # Init MCP server
 mcp = FastMCP("MCP")
 
+# Public Supabase storage bucket for synthesized speech
+TTS_AUDIO_BUCKET = os.getenv("SUPABASE_TTS_BUCKET", "tts-audio")
 
-# Create OpenAI client
-client = OpenAI(
-    api_key=os.getenv("OPENAI_API_KEY")
-)
 
+@functools.lru_cache(maxsize=256)
+def _synthesize_speech(text: str, voice: str, tone: str) -> str:
+    response = get_openai().audio.speech.create(
+        model="gpt-4o-mini-tts",
+        voice=voice,
+        input=text,
+        instructions=f"Speak in a {tone} tone.",
+        response_format="mp3",  # more compatible than PCM
+    )
+
+    # Host the MP3 instead of returning a base64 data URI (~33% larger over stdio).
+    # Named by content, so repeating a request overwrites one object instead of adding another.
+    key = hashlib.sha256(f"{voice}|{tone}|{text}".encode("utf-8")).hexdigest()
+    filename = f"{key}.mp3"
+    bucket = get_supabase().storage.from_(TTS_AUDIO_BUCKET)
+    bucket.upload(filename, response.content, {"content-type": "audio/mpeg", "upsert": "true"})
+    return bucket.get_public_url(filename)
 
 @mcp.tool()
 def text_to_speech_gpt4o(text: str, voice: str = "nova", tone: str = "cheerful") -> str:
     """
-    Convert input text to speech using GPT-4o TTS and return base64 audio.
+    Convert input text to speech using GPT-4o TTS and return a public MP3 URL.
 
     Args:
         text: The text to synthesize.
@@ -39,56 +77,54 @@ def text_to_speech_gpt4o(text: str, voice: str = "nova", tone: str = "cheerful")
         tone: Instruction to define speech style (e.g., "cheerful", "serious", etc.)
 
     Returns:
-        A base64-encoded audio URL (as a data URI).
+        A public Supabase storage URL of the MP3 file.
     """
-    print(f"🎤 [TTS] Generating speech for: {text}")
+    log.info("🎤 [TTS] Generating speech, text len=%d", len(text))
+    return _synthesize_speech(text, voice, tone)
 
-    response = client.audio.speech.create(
-        model="gpt-4o-mini-tts",
-        voice=voice,
-        input=text,
-        instructions=f"Speak in a {tone} tone.",
-        response_format="mp3",  # more compatible than PCM
-    )
+@mcp.tool()
+async def chat_gpt4o(prompt: str, ctx: Context, stream_id: str = "") -> str:
+    """
+    Chat with GPT-4o.
 
-    # Save to memory buffer
-    buffer = BytesIO()
-    buffer.write(response.content)
-    buffer.seek(0)
+    Args:
+        prompt: The user prompt
+        stream_id: Optional client-chosen ID. When set, tokens are pushed to the
+            client as they arrive via log notifications on logger "stream:<stream_id>".
 
-    # Encode as base64 for browser use
-    b64_audio = base64.b64encode(buffer.read()).decode("utf-8")
-    return f"data:audio/mp3;base64,{b64_audio}"
-    
-@mcp.tool()
-async def chat_gpt4o(prompt: str) -> str:
-    print("🧠 [MCP] chat_gpt4o called with prompt:", prompt)
+    Returns:
+        The full completion text.
+    """
+    log.info("🧠 [MCP] chat_gpt4o called, prompt len=%d", len(prompt))
 
-    loop = asyncio.get_running_loop()
-    
     try:
-        print("🔌 [MCP] Sending prompt to OpenAI")
-
-        # Run blocking OpenAI call in thread executor
-        response = await loop.run_in_executor(
-            None,
-            lambda: client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {"role": "system", "content": "You are a helpful assistant."},
-                    {"role": "user", "content": prompt}
-                ]
-            )
+        log.debug("🔌 [MCP] Sending prompt to OpenAI")
+
+        stream = await get_async_openai().chat.completions.create(
+            model="gpt-4o",
+            messages=[
+                {"role": "system", "content": "You are a helpful assistant."},
+                {"role": "user", "content": prompt}
+            ],
+            stream=True
         )
 
-        result = response.choices[0].message.content
-        print("✅ [MCP] GPT-4o response:", result)
+        parts = []
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content or ""
+            if delta:
+                parts.append(delta)
+                if stream_id:
+                    await ctx.log("info", delta, logger_name=f"stream:{stream_id}")
+
+        result = "".join(parts)
+        log.info("✅ [MCP] GPT-4o response len=%d", len(result))
         return result
 
     except Exception as e:
-        import traceback
-        traceback.print_exc()
-        print("❌ [MCP] OpenAI error:", str(e))
+        log.exception("❌ [MCP] OpenAI error")
         return f"[OpenAI Error] {str(e)}"
 
 @mcp.tool()
@@ -99,10 +135,10 @@ def gen_image_dalle3(prompt: str) -> str:
     Args:
         prompt: Description of the image to generate
     """
-    print("🎨 [MCP] Generating image with prompt:", prompt)
+    log.info("🎨 [MCP] Generating image, prompt len=%d", len(prompt))
 
     try:
-        response = client.images.generate(
+        response = get_openai().images.generate(
             model="dall-e-3",
             prompt=prompt,
             size="1024x1024",
@@ -111,13 +147,18 @@ def gen_image_dalle3(prompt: str) -> str:
         )
 
         image_url = response.data[0].url
-        print("✅ [MCP] Image generated:", image_url)
+        log.info("✅ [MCP] Image generated: %s", image_url)
         return image_url
 
     except Exception as e:
-        print("❌ [MCP] Image generation error:", str(e))
+        log.exception("❌ [MCP] Image generation error")
         return f"[ImageGen Error] {str(e)}"
     
+# Rows for each (role, search, sort, order) are fetched in one window and
+# paginated from memory; any member write clears the cache.
+MEMBERS_WINDOW = 200
+_members_cache = TTLCache(maxsize=64, ttl=30)
+
 # Define a tool to fetch all members
 @mcp.tool()
 def get_all_members(
@@ -139,7 +180,13 @@ def get_all_members(
         sort: Column to sort by (default: created_at)
         order: Sort direction ("asc" or "desc")
     """
-    query = supabase.table("members").select("*")
+    key = (role, search, sort, order.lower())
+    in_window = offset + limit <= MEMBERS_WINDOW
+
+    if in_window and key in _members_cache:
+        return _members_cache[key][offset:offset + limit]
+
+    query = get_supabase().table("members").select("*")
 
     if role:
         query = query.eq("role", role)
@@ -150,10 +197,14 @@ def get_all_members(
         )
 
     query = query.order(sort, desc=(order.lower() == "desc"))
-    query = query.range(offset, offset + limit - 1)
 
-    response = query.execute()
-    return response.data
+    if not in_window:
+        query = query.range(offset, offset + limit - 1)
+        return query.execute().data
+
+    rows = query.range(0, MEMBERS_WINDOW - 1).execute().data
+    _members_cache[key] = rows
+    return rows[offset:offset + limit]
 
 # Define a tool to fetch a single member by ID
 @mcp.tool()
@@ -164,7 +215,7 @@ def get_member_by_id(member_id: str) -> dict:
     Args:
         member_id: ID of the member to fetch
     """
-    response = supabase.table("members").select("*").eq("id", member_id).execute()
+    response = get_supabase().table("members").select("*").eq("id", member_id).execute()
     return response.data[0] if response.data else None
 
 # Define a tool to create a new member
@@ -184,7 +235,8 @@ def create_member(
         role: Role of the member (default: "user")
         status: Status of the member (default: "active")
     """
-    response = supabase.table("members").insert({
+    _members_cache.clear()
+    response = get_supabase().table("members").insert({
         "name": name,
         "email": email,
         "role": role,
@@ -212,12 +264,20 @@ def update_member(
         role: Role of the member (optional)
         status: Status of the member (optional)
     """
-    response = supabase.table("members").update({
-        "name": name,
-        "email": email,
-        "role": role,
-        "status": status
-    }).eq("id", member_id).execute()
+    # Only send the fields that were provided, so omitted columns aren't set to NULL
+    payload = {
+        k: v for k, v in {
+            "name": name,
+            "email": email,
+            "role": role,
+            "status": status
+        }.items() if v is not None
+    }
+    if not payload:
+        return get_member_by_id(member_id)
+
+    _members_cache.clear()
+    response = get_supabase().table("members").update(payload).eq("id", member_id).execute()
     return response.data[0]
 
 # Define a tool to delete a member
@@ -230,7 +290,8 @@ def delete_member(member_id: str) -> dict:
     Args:
         member_id: ID of the member to delete
     """
-    response = supabase.table("members").delete().eq("id", member_id).execute()
+    _members_cache.clear()
+    response = get_supabase().table("members").delete().eq("id", member_id).execute()
     return response.data[0]
 
 
@@ -239,19 +300,28 @@ def capture_image_from_camera() -> str:
     """
     Trigger frontend to open webcam and capture image.
     """
-    print("📸 [MCP] Triggering frontend camera...")
+    log.info("📸 [MCP] Triggering frontend camera...")
     return "WAITING_FOR_CLIENT"
     
 
 
-@mcp.tool()
-def describe_image_from_camera(image_url: str) -> str:
-    """
-    Send a public image URL to GPT-4o to analyze its content.
-    """
-    print("🧠 Describing image:", image_url)
+# Descriptions are keyed by sha256(image_url): camera uploads get a unique
+# filename per image, so a repeat URL means the same picture. Kept in memory
+# and in a small SQLite file so repeats survive server restarts.
+VISION_CACHE_PATH = os.path.join(".cache", "vision.sqlite")
+
+# _describe runs in worker threads; the shared connection needs a lock
+_vision_db_lock = threading.Lock()
+
+@functools.cache
+def _vision_db():
+    os.makedirs(os.path.dirname(VISION_CACHE_PATH), exist_ok=True)
+    conn = sqlite3.connect(VISION_CACHE_PATH, check_same_thread=False)
+    conn.execute("CREATE TABLE IF NOT EXISTS descriptions (key TEXT PRIMARY KEY, description TEXT NOT NULL)")
+    return conn
 
-    response = client.responses.create(
+def _call_openai_vision(image_url: str) -> str:
+    response = get_openai().responses.create(
         model="gpt-4.1-mini",
         input=[{
             "role": "user",
@@ -264,9 +334,35 @@ def describe_image_from_camera(image_url: str) -> str:
             ],
         }],
     )
-
     return response.output_text
 
+@functools.lru_cache(maxsize=256)
+def _describe(image_url: str) -> str:
+    key = hashlib.sha256(image_url.encode("utf-8")).hexdigest()
+    db = _vision_db()
+
+    with _vision_db_lock:
+        row = db.execute("SELECT description FROM descriptions WHERE key = ?", (key,)).fetchone()
+    if row:
+        log.info("🧠 Vision cache hit: %s", image_url)
+        return row[0]
+
+    description = _call_openai_vision(image_url)
+    with _vision_db_lock:
+        db.execute("INSERT OR REPLACE INTO descriptions (key, description) VALUES (?, ?)", (key, description))
+        db.commit()
+    return description
+
+@mcp.tool()
+async def describe_image_from_camera(image_url: str) -> str:
+    """
+    Send a public image URL to GPT-4o to analyze its content.
+    """
+    log.info("🧠 Describing image: %s", image_url)
+    # Off the event loop: the app starts this speculatively, and a sync tool
+    # would stall every other call on the shared session until it finished
+    return await anyio.to_thread.run_sync(_describe, image_url)
+
 if __name__ == "__main__":
     mcp.run(transport="stdio")
 